@@ -3,10 +3,34 @@ from tkinter import messagebox, ttk
 from PIL import Image
 from tkcalendar import Calendar
 from tkinter import filedialog
-from datetime import datetime
+import tkinter
+from datetime import date, datetime, timedelta
 from decimal import Decimal, InvalidOperation
+from operator import itemgetter
+from array import array
+from collections import OrderedDict
+from contextlib import closing
+import argparse
+import bisect
+import cProfile
 import csv
+import functools
+import glob
+import hashlib
+import io
+import json
+import mmap
+import os
+import pstats
+import queue
 import re
+import sqlite3
+import sys
+import tarfile
+import threading
+import time
+import traceback
+import zipfile
 import logging
 
 logging.basicConfig(
@@ -42,6 +66,19 @@ PREVIEW_ROW_HEIGHT = 44
 
 # ---------------- DATA ---------------- #
 entries_data = []
+# "single" shows entries_data, "batch" shows the accumulated transfer batch
+preview_mode = "single"
+
+columns = [
+    "Customer Reference (GL)",
+    "Payee Name",
+    "Payee Bank Acc No.",
+    "Amount",
+    "Reason",
+    "Payment Date (dd-mm-yy)",
+    "Debit Acc No.",
+    "Payee Email Address",
+]
 
 bank_account_map = {
     "SCB (02-01)": "X0002110915401",
@@ -84,6 +121,136 @@ def excel_number(d: Decimal):
     return format(d, "f")
 
 
+# ---------------- PAYMENT CALENDAR ---------------- #
+WEEKEND_DAYS = (4, 5)  # Friday, Saturday (date.weekday())
+# Fixed-date Bangladesh bank holidays as (day, month). Eid and other lunar
+# holidays move every year and come from the holidays file.
+FIXED_HOLIDAYS = [
+    (21, 2),  # Shaheed Day
+    (26, 3),  # Independence Day
+    (14, 4),  # Pohela Boishakh
+    (1, 5),  # May Day
+    (1, 7),  # Bank holiday
+    (16, 12),  # Victory Day
+    (25, 12),  # Christmas Day
+    (31, 12),  # Bank holiday
+]
+HOLIDAYS_FILE = "holidays.txt"
+CALENDAR_FIRST_YEAR = 2020
+CALENDAR_YEARS_AHEAD = 10
+PAYMENT_DATE_FORMAT = "%d/%m/%Y"
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_payment_date(text: str):
+    # Batches repeat a handful of dates, so strptime runs once per value
+    try:
+        return datetime.strptime(text.strip(), PAYMENT_DATE_FORMAT).date()
+    except ValueError:
+        return None
+
+
+def load_holidays(path):
+    # One holiday per line: dd/mm/yyyy for a single date, dd/mm for every
+    # year. Blank lines and "#" comments are ignored.
+    dates, yearly = set(), set()
+    if not path or not os.path.exists(path):
+        return dates, yearly
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            text = line.split("#", 1)[0].strip()
+            if not text:
+                continue
+            try:
+                if text.count("/") == 1:
+                    day, month = (int(p) for p in text.split("/"))
+                    date(2000, month, day)  # 2000 is a leap year
+                    yearly.add((day, month))
+                else:
+                    dates.add(datetime.strptime(text, PAYMENT_DATE_FORMAT).date())
+            except ValueError:
+                raise ValueError(f"{path}:{line_no}: not a dd/mm/yyyy date: {text}")
+    return dates, yearly
+
+
+class PaymentCalendar:
+    # Closed days are held as a bytearray over a fixed range of ordinals
+    # (O(1) lookups) and open days as a sorted array (bisect for "next").
+    def __init__(self, holidays=(), yearly=(), first_year=None, last_year=None):
+        today = date.today()
+        first_year = first_year or min(CALENDAR_FIRST_YEAR, today.year)
+        last_year = last_year or today.year + CALENDAR_YEARS_AHEAD
+        self.first = date(first_year, 1, 1)
+        self.last = date(last_year, 12, 31)
+        self._base = self.first.toordinal()
+        self.holidays = set(holidays)
+        self.yearly = set(FIXED_HOLIDAYS) | set(yearly)
+
+        span = self.last.toordinal() - self._base + 1
+        self._closed = bytearray(span)
+        for offset in range(span):
+            day = date.fromordinal(self._base + offset)
+            if self._is_closed(day):
+                self._closed[offset] = 1
+        self._open = array(
+            "l", (self._base + i for i, closed in enumerate(self._closed) if not closed)
+        )
+
+    def _is_closed(self, day) -> bool:
+        return (
+            day.weekday() in WEEKEND_DAYS
+            or (day.day, day.month) in self.yearly
+            or day in self.holidays
+        )
+
+    def is_business_day(self, day) -> bool:
+        offset = day.toordinal() - self._base
+        if 0 <= offset < len(self._closed):
+            return not self._closed[offset]
+        return not self._is_closed(day)
+
+    def next_business_day(self, day, include_today=True):
+        ordinal = day.toordinal() + (0 if include_today else 1)
+        i = bisect.bisect_left(self._open, ordinal)
+        if i < len(self._open) and ordinal >= self._base:
+            return date.fromordinal(self._open[i])
+        day = date.fromordinal(ordinal)
+        while self._is_closed(day):
+            day += timedelta(days=1)
+        return day
+
+    def closed_days(self, first, last):
+        # Holidays (not weekends) between two dates, for the date picker
+        start = max(first.toordinal(), self._base) - self._base
+        end = min(last.toordinal(), self.last.toordinal()) - self._base
+        for offset in range(start, end + 1):
+            if self._closed[offset]:
+                day = date.fromordinal(self._base + offset)
+                if day.weekday() not in WEEKEND_DAYS:
+                    yield day
+
+    def check_date(self, text: str):
+        # None when the date is usable, otherwise the reason it is not
+        day = parse_payment_date(text)
+        if day is None:
+            return "not a dd/mm/yyyy date"
+        if not self.is_business_day(day):
+            return "weekend" if day.weekday() in WEEKEND_DAYS else "holiday"
+        return None
+
+
+def validate_payment_dates(calendar, values):
+    # Yields (index, value, problem); each distinct value is checked once
+    seen = {}
+    for index, value in enumerate(values):
+        try:
+            problem = seen[value]
+        except KeyError:
+            problem = seen[value] = calendar.check_date(value)
+        if problem:
+            yield index, value, problem
+
+
 # ---------------- OPTION-MENU LIST STYLING (DROPDOWN) ---------------- #
 def style_optionmenu_dropdown(opt: ctk.CTkOptionMenu):
     for attr in ("_dropdown_menu", "dropdown_menu"):
@@ -103,9 +270,17 @@ def style_optionmenu_dropdown(opt: ctk.CTkOptionMenu):
 
 # ---------------- DATE PICKER ---------------- #
 class ModernDatePicker(ctk.CTkFrame):
-    def __init__(self, master, initial_date=None, date_pattern="%d/%m/%Y", **kwargs):
+    def __init__(
+        self,
+        master,
+        initial_date=None,
+        date_pattern="%d/%m/%Y",
+        payment_calendar=None,
+        **kwargs,
+    ):
         super().__init__(master, fg_color="transparent", **kwargs)
         self.date_pattern = date_pattern
+        self.payment_calendar = payment_calendar
         self._selected = initial_date or datetime.now()
 
         self.grid_columnconfigure(0, weight=1)
@@ -139,6 +314,13 @@ class ModernDatePicker(ctk.CTkFrame):
         self.entry.delete(0, "end")
         self.entry.insert(0, dt.strftime(self.date_pattern))
 
+    def set_text(self, value: str):
+        try:
+            self.set_date(datetime.strptime(value, self.date_pattern))
+        except ValueError:
+            self.entry.delete(0, "end")
+            self.entry.insert(0, value)
+
     def get(self) -> str:
         return self.entry.get().strip()
 
@@ -181,8 +363,9 @@ class ModernDatePicker(ctk.CTkFrame):
             selectforeground="white",
             normalbackground=CARD_BG,
             normalforeground=TEXT_DARK,
+            weekenddays=[d + 1 for d in WEEKEND_DAYS],
             weekendbackground=CARD_BG,
-            weekendforeground=TEXT_DARK,
+            weekendforeground="#B3B4B5",
             othermonthbackground=CARD_BG,
             othermonthforeground=TEXT_MUTED,
             disabledbackground=CARD_BG,
@@ -190,6 +373,15 @@ class ModernDatePicker(ctk.CTkFrame):
         )
         cal.pack(fill="both", expand=True, padx=10, pady=(0, 10))
 
+        # Grey out bank holidays around the shown year (weekends use weekenddays)
+        if self.payment_calendar is not None:
+            year = self._selected.year
+            for day in self.payment_calendar.closed_days(
+                date(year - 1, 1, 1), date(year + 1, 12, 31)
+            ):
+                cal.calevent_create(day, "Bank holiday", "holiday")
+            cal.tag_config("holiday", background=CARD_BG, foreground="#B3B4B5")
+
         btn_row = ctk.CTkFrame(wrap, fg_color="transparent")
         btn_row.pack(fill="x", padx=12, pady=(0, 12))
 
@@ -197,10 +389,22 @@ class ModernDatePicker(ctk.CTkFrame):
             picked = cal.get_date()
             try:
                 dt = datetime.strptime(picked, "%d/%m/%Y")
-                self.set_date(dt)
-                top.destroy()
             except ValueError:
                 messagebox.showerror("Error", "Invalid date selected.")
+                return
+            if self.payment_calendar is not None:
+                problem = self.payment_calendar.check_date(picked)
+                if problem:
+                    nxt = self.payment_calendar.next_business_day(dt.date())
+                    messagebox.showerror(
+                        "Error",
+                        f"{picked} is a {problem}. "
+                        f"Next business day: {nxt.strftime('%d/%m/%Y')}",
+                        parent=top,
+                    )
+                    return
+            self.set_date(dt)
+            top.destroy()
 
         ctk.CTkButton(
             btn_row,
@@ -254,10 +458,10 @@ def safe_filename(name: str) -> str:
 def build_csv_filename(
     custom_ref: str, debit_label: str, payee_label: str, pay_date_ddmmyyyy: str
 ) -> str:
-    try:
-        dt = datetime.strptime(pay_date_ddmmyyyy, "%d/%m/%Y")
-        date_part = dt.strftime("%d.%m.%Y")
-    except ValueError:
+    day = parse_payment_date(pay_date_ddmmyyyy)
+    if day is not None:
+        date_part = day.strftime("%d.%m.%Y")
+    else:
         date_part = pay_date_ddmmyyyy.replace("/", ".")
     prefix = f"{custom_ref}_BT"
     transfer_phrase = build_transfer_phrase(debit_label, payee_label)
@@ -265,6 +469,1144 @@ def build_csv_filename(
     return safe_filename(filename)
 
 
+def build_batch_filename(transfer_count: int, pay_dates) -> str:
+    days = [parse_payment_date(d) for d in pay_dates]
+    if days and None not in days:
+        first, last = min(days), max(days)
+        date_part = first.strftime("%d.%m.%Y")
+        if last != first:
+            date_part += "-" + last.strftime("%d.%m.%Y")
+    elif len(pay_dates) == 1:
+        date_part = next(iter(pay_dates)).replace("/", ".")
+    else:
+        date_part = "mixed dates"
+    filename = f"BATCH {transfer_count} transfers - Fund Transfer -{date_part}.csv"
+    return safe_filename(filename)
+
+
+# ---------------- ARCHIVE OUTPUT ---------------- #
+ARCHIVE_SUFFIXES = (".zip", ".tar.gz", ".tgz")
+ARCHIVE_QUEUE_SIZE = 16
+EXPORT_FILETYPES = [
+    ("CSV files", "*.csv"),
+    ("ZIP archive", "*.zip"),
+    ("Gzip archive", "*.tar.gz"),
+]
+
+
+def is_archive_path(path: str) -> bool:
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def render_csv_bytes(rows) -> bytes:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    writer.writerows(rows)
+    return buf.getvalue().encode("utf-8-sig")
+
+
+class ArchiveWriter:
+    # Streams CSV entries straight into a .zip or .tar.gz. Rendering and
+    # compression happen on a worker thread so the caller can keep producing
+    # rows; a manifest.json listing every entry is written last.
+    def __init__(self, path):
+        self.path = path
+        self.manifest = []
+        self._names = set()
+        self._queue = queue.Queue(maxsize=ARCHIVE_QUEUE_SIZE)
+        self._error = None
+        self._ended = False  # worker has taken the end marker from the queue
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(discard=exc_type is not None)
+
+    def add(self, name, rows, **meta):
+        if self._error is not None:
+            raise self._error
+        # Two transfers can share a filename (same ref, accounts and date)
+        base, ext = os.path.splitext(name)
+        n = 2
+        while name in self._names:
+            name = f"{base} ({n}){ext}"
+            n += 1
+        self._names.add(name)
+        self._queue.put((name, tuple(rows), meta))
+        return name
+
+    def close(self, discard=False):
+        self._queue.put(None)
+        self._thread.join()
+        if discard or self._error is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        try:
+            if self.path.lower().endswith(".zip"):
+                with zipfile.ZipFile(self.path, "w", zipfile.ZIP_DEFLATED) as zf:
+                    self._drain(zf.writestr)
+            else:
+                with tarfile.open(self.path, "w:gz") as tf:
+
+                    def add_member(name, data):
+                        info = tarfile.TarInfo(name)
+                        info.size = len(data)
+                        info.mtime = int(time.time())
+                        tf.addfile(info, io.BytesIO(data))
+
+                    self._drain(add_member)
+        except Exception as e:
+            self._error = e
+            # Keep consuming so a producer blocked on put() is released. If
+            # the end marker is already gone (manifest or closing the archive
+            # failed) nothing else will arrive, so don't wait for it.
+            if not self._ended:
+                while self._queue.get() is not None:
+                    pass
+
+    def _drain(self, write_entry):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._ended = True
+                break
+            name, rows, meta = item
+            data = render_csv_bytes(rows)
+            write_entry(name, data)
+            self.manifest.append(
+                {
+                    "name": name,
+                    "rows": len(rows),
+                    "bytes": len(data),
+                    "sha256": hashlib.sha256(data).hexdigest(),
+                    **meta,
+                }
+            )
+        manifest = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "entries": self.manifest,
+            "total_rows": sum(e["rows"] for e in self.manifest),
+        }
+        write_entry("manifest.json", json.dumps(manifest, indent=2).encode("utf-8"))
+
+
+# ---------------- PREVIEW CACHE ---------------- #
+PREVIEW_CACHE_MAX_ENTRIES = 20
+PREVIEW_CACHE_MAX_MB = 8
+
+
+def rows_size_bytes(rows) -> int:
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row)
+    return size
+
+
+def preview_rules_fingerprint():
+    # Cached rows depend on the account registry and the split limit
+    return (tuple(bank_account_map.items()), MAX_PER_ROW)
+
+
+class PreviewCache:
+    def __init__(
+        self, max_entries=PREVIEW_CACHE_MAX_ENTRIES, max_mb=PREVIEW_CACHE_MAX_MB
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._items = OrderedDict()  # key -> (rows, size)
+        self._bytes = 0
+        self._fingerprint = preview_rules_fingerprint()
+
+    def _check_rules(self):
+        fingerprint = preview_rules_fingerprint()
+        if fingerprint != self._fingerprint:
+            self.clear()
+            self._fingerprint = fingerprint
+
+    def clear(self):
+        self._items.clear()
+        self._bytes = 0
+
+    def get(self, key):
+        self._check_rules()
+        item = self._items.get(key)
+        if item is None:
+            return None
+        self._items.move_to_end(key)
+        return item[0]
+
+    def put(self, key, rows):
+        self._check_rules()
+        rows = tuple(rows)
+        size = rows_size_bytes(rows)
+        if size > self.max_bytes:
+            return rows
+        old = self._items.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._items[key] = (rows, size)
+        self._bytes += size
+        while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, evicted) = self._items.popitem(last=False)
+            self._bytes -= evicted
+        return rows
+
+    def recent(self):
+        self._check_rules()
+        return list(reversed(self._items))
+
+
+def preview_label(key) -> str:
+    # Every field of the cache key is shown, so labels tell previews apart
+    ref, total_amt, debit_label, payee_label, reason, email, pay_date = key
+    return (
+        f"{ref} | {total_amt:,} | {debit_label} > {payee_label} | {pay_date}"
+        f" | {reason} | {email}"
+    )
+
+
+# ---------------- TRANSFER BATCH ---------------- #
+class TransferBatch:
+    # Transfers accumulated into one export file. Totals and counts are kept
+    # up to date on every add/remove so nothing has to rescan the rows.
+    def __init__(self):
+        self._transfers = OrderedDict()  # transfer id -> (form key, rows)
+        self._next_id = 1
+        self.row_count = 0
+        self.total = Decimal(0)
+        self.pair_totals = {}  # (debit label, payee label) -> Decimal
+        self._pair_counts = {}
+        self._key_counts = {}  # form key -> transfers with that key
+
+    def __len__(self):
+        return len(self._transfers)
+
+    def __contains__(self, transfer_id):
+        return transfer_id in self._transfers
+
+    def has_key(self, key) -> bool:
+        return key in self._key_counts
+
+    def add(self, key, rows) -> int:
+        transfer_id = self._next_id
+        self._next_id += 1
+        rows = tuple(rows)
+        self._transfers[transfer_id] = (key, rows)
+        self._key_counts[key] = self._key_counts.get(key, 0) + 1
+
+        _, total_amt, debit_label, payee_label = key[:4]
+        pair = (debit_label, payee_label)
+        self.row_count += len(rows)
+        self.total += total_amt
+        self.pair_totals[pair] = self.pair_totals.get(pair, Decimal(0)) + total_amt
+        self._pair_counts[pair] = self._pair_counts.get(pair, 0) + 1
+        return transfer_id
+
+    def remove(self, transfer_id):
+        key, rows = self._transfers.pop(transfer_id)
+        self._key_counts[key] -= 1
+        if not self._key_counts[key]:
+            del self._key_counts[key]
+
+        _, total_amt, debit_label, payee_label = key[:4]
+        pair = (debit_label, payee_label)
+        self.row_count -= len(rows)
+        self.total -= total_amt
+        self._pair_counts[pair] -= 1
+        if self._pair_counts[pair]:
+            self.pair_totals[pair] -= total_amt
+        else:
+            del self._pair_counts[pair]
+            del self.pair_totals[pair]
+        return key, rows
+
+    def clear(self):
+        self._transfers.clear()
+        self.row_count = 0
+        self.total = Decimal(0)
+        self.pair_totals.clear()
+        self._pair_counts.clear()
+        self._key_counts.clear()
+
+    def transfers(self):
+        # (transfer id, form key, rows) in the order they were added
+        return [(tid, key, rows) for tid, (key, rows) in self._transfers.items()]
+
+    def iter_rows(self):
+        for _, rows in self._transfers.values():
+            yield from rows
+
+    def pay_dates(self):
+        return {key[6] for key, _ in self._transfers.values()}
+
+
+# ---------------- RECONCILIATION ---------------- #
+# Key columns used to match our generated rows against the bank statement.
+RECON_KEY_COLUMNS = (
+    "Customer Reference (GL)",
+    "Payee Bank Acc No.",
+    "Amount",
+    "Payment Date (dd-mm-yy)",
+)
+RECON_DATE_FORMATS = ("%d/%m/%Y", "%d-%m-%Y", "%d-%m-%y", "%d.%m.%Y", "%Y-%m-%d")
+RECON_REPORT_COLUMNS = [
+    "Status",
+    "Source",
+    "Customer Reference (GL)",
+    "Payee Bank Acc No.",
+    "Amount",
+    "Payment Date",
+    "Other Amount",
+    "File",
+    "Line",
+]
+
+RECON_DATE_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=RECON_DATE_CACHE_SIZE)
+def normalize_recon_date(text: str):
+    # Statement exports repeat the same few dates millions of times. Returns
+    # yyyy-mm-dd, or None when no known format fits.
+    value = text.strip()
+    for fmt in RECON_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+
+def iter_recon_rows(paths, key_columns=RECON_KEY_COLUMNS):
+    # Yields (ref, account, amount, date, path, line_no) without loading
+    # files; amount or date is None when it does not parse
+    for path in paths:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                continue
+            header = [h.strip() for h in header]
+            try:
+                i_ref, i_acc, i_amt, i_date = (header.index(c) for c in key_columns)
+            except ValueError:
+                raise ValueError(
+                    f"{path}: missing one of the key columns {list(key_columns)}"
+                )
+            width = max(i_ref, i_acc, i_amt, i_date)
+            pick = itemgetter(i_ref, i_acc, i_amt, i_date)
+            normalize_date = normalize_recon_date
+            for line_no, row in enumerate(reader, start=2):
+                if len(row) <= width:
+                    continue
+                ref, acc, amt, pay_day = pick(row)
+                try:
+                    amount = Decimal(amt.replace(",", ""))
+                except InvalidOperation:
+                    amount = None
+                yield (
+                    ref.strip(),
+                    acc.replace(" ", "").replace("-", "").upper(),
+                    amount,
+                    normalize_date(pay_day),
+                    path,
+                    line_no,
+                )
+
+
+def is_recon_report(path) -> bool:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        header = next(csv.reader(f), [])
+    return [h.strip() for h in header] == RECON_REPORT_COLUMNS
+
+
+def collect_csv_paths(targets, skip=None):
+    # Folders contribute their CSVs, minus the report being written (skip)
+    # and earlier reconcile reports saved alongside the exports
+    skip = os.path.abspath(skip) if skip else None
+    paths = []
+    for target in targets:
+        if os.path.isdir(target):
+            for name in sorted(os.listdir(target)):
+                path = os.path.join(target, name)
+                if not name.lower().endswith(".csv") or os.path.abspath(path) == skip:
+                    continue
+                if not is_recon_report(path):
+                    paths.append(path)
+        else:
+            paths.append(target)
+    return paths
+
+
+def reconcile(generated_paths, statement_paths, report=None, statement_columns=None):
+    # Index the smaller side by (ref, account, date) -> {amount: [left, total]}
+    # and stream the larger one through it, so memory follows the smaller side.
+    gen_size = sum(os.path.getsize(p) for p in generated_paths)
+    stmt_size = sum(os.path.getsize(p) for p in statement_paths)
+    gen_source = (generated_paths, RECON_KEY_COLUMNS, "generated")
+    stmt_source = (statement_paths, statement_columns or RECON_KEY_COLUMNS, "statement")
+    if gen_size <= stmt_size:
+        indexed, streamed = gen_source, stmt_source
+    else:
+        indexed, streamed = stmt_source, gen_source
+
+    counts = {
+        "matched": 0,
+        "missing_from_statement": 0,
+        "missing_from_generated": 0,
+        "duplicated": 0,
+        "amount_mismatch": 0,
+        "invalid": 0,
+    }
+    missing_status = {
+        "generated": "missing_from_statement",
+        "statement": "missing_from_generated",
+    }
+
+    def emit(status, source, ref, acc, amount, pay_day, other="", path="", line=""):
+        counts[status] += 1
+        if report is not None:
+            report.writerow(
+                [status, source, ref, acc, amount, pay_day, other, path, line]
+            )
+
+    index_paths, index_columns, index_side = indexed
+    stream_paths, stream_columns, stream_side = streamed
+
+    index = {}
+    for ref, acc, amount, pay_day, path, line in iter_recon_rows(
+        index_paths, index_columns
+    ):
+        if amount is None or pay_day is None:
+            emit("invalid", index_side, ref, acc, amount, pay_day, "", path, line)
+            continue
+        amounts = index.get((ref, acc, pay_day))
+        if amounts is None:
+            amounts = index[(ref, acc, pay_day)] = {}
+        slot = amounts.get(amount)
+        if slot is None:
+            amounts[amount] = [1, 1]
+        else:
+            slot[0] += 1
+            slot[1] += 1
+
+    # Rows that share (ref, account, date) but not the amount wait until the
+    # stream ends so a later exact match is never stolen by a mismatch pairing.
+    pending = []
+    stream_missing = missing_status[stream_side]
+    # A statement copy beyond what we generated means the bank paid twice; an
+    # extra generated copy (split chunks are identical rows) is just unpaid.
+    stream_surplus = "duplicated" if stream_side == "statement" else stream_missing
+    for ref, acc, amount, pay_day, path, line in iter_recon_rows(
+        stream_paths, stream_columns
+    ):
+        if amount is None or pay_day is None:
+            emit("invalid", stream_side, ref, acc, amount, pay_day, "", path, line)
+            continue
+        amounts = index.get((ref, acc, pay_day))
+        if amounts is None:
+            emit(stream_missing, stream_side, ref, acc, amount, pay_day, "", path, line)
+            continue
+        slot = amounts.get(amount)
+        if slot is None:
+            pending.append((ref, acc, amount, pay_day, path, line))
+        elif slot[0] > 0:
+            slot[0] -= 1
+            counts["matched"] += 1
+        else:
+            emit(stream_surplus, stream_side, ref, acc, amount, pay_day, "", path, line)
+
+    for ref, acc, amount, pay_day, path, line in pending:
+        amounts = index[(ref, acc, pay_day)]
+        other = next((a for a, slot in amounts.items() if slot[0] > 0), None)
+        if other is None:
+            emit(stream_missing, stream_side, ref, acc, amount, pay_day, "", path, line)
+            continue
+        amounts[other][0] -= 1
+        emit(
+            "amount_mismatch", stream_side, ref, acc, amount, pay_day, other, path, line
+        )
+
+    for (ref, acc, pay_day), amounts in index.items():
+        for amount, (left, total) in amounts.items():
+            if not left:
+                continue
+            # Only the statement side can hold duplicates (see stream_surplus)
+            if index_side == "statement" and left < total:
+                status = "duplicated"
+            else:
+                status = missing_status[index_side]
+            for _ in range(left):
+                emit(status, index_side, ref, acc, amount, pay_day)
+
+    return counts
+
+
+def run_reconcile(args):
+    statement_columns = None
+    if args.statement_columns:
+        statement_columns = tuple(c.strip() for c in args.statement_columns.split(","))
+        if len(statement_columns) != 4:
+            raise SystemExit(
+                "--statement-columns needs 4 names: reference,account,amount,date"
+            )
+
+    started = time.perf_counter()
+    try:
+        generated = collect_csv_paths(args.generated, skip=args.report)
+        statements = collect_csv_paths(args.statement, skip=args.report)
+        if args.report:
+            with open(args.report, "w", newline="", encoding="utf-8-sig") as f:
+                writer = csv.writer(f)
+                writer.writerow(RECON_REPORT_COLUMNS)
+                counts = reconcile(generated, statements, writer, statement_columns)
+        else:
+            counts = reconcile(generated, statements, None, statement_columns)
+    except (ValueError, OSError) as e:
+        raise SystemExit(f"Reconcile failed: {e}")
+    elapsed = time.perf_counter() - started
+
+    for status, count in counts.items():
+        print(f"{status:<24}{count:>12}")
+    print(f"{'elapsed':<24}{elapsed:>11.2f}s")
+    logging.info(
+        "RECONCILE | "
+        + " | ".join(f"{k}={v}" for k, v in counts.items())
+        + f" | Files={len(generated)}+{len(statements)}"
+    )
+    unresolved = sum(v for k, v in counts.items() if k != "matched")
+    return 1 if unresolved else 0
+
+
+# ---------------- LOG INDEX ---------------- #
+LOG_INDEX_FILE = "transfers.idx"
+LOG_FILES = "transfers.log*"
+LOG_INDEXED_KINDS = ("PREVIEW", "SUCCESS", "ERROR")
+LOG_INDEX_BATCH = 5000
+
+LOG_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY, signature TEXT UNIQUE, path TEXT, offset INTEGER,
+    updated TEXT
+);
+CREATE TABLE IF NOT EXISTS events (
+    ts TEXT, kind TEXT, ref TEXT, debit TEXT, payee TEXT, rows INTEGER,
+    file TEXT, source INTEGER, offset INTEGER
+);
+CREATE INDEX IF NOT EXISTS events_ref ON events (ref);
+CREATE INDEX IF NOT EXISTS events_debit ON events (debit, ts);
+CREATE INDEX IF NOT EXISTS events_payee ON events (payee, ts);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+"""
+
+
+def log_signature(mm):
+    # A log is identified by its first full line (timestamped), so a rotated
+    # file keeps its checkpoint under its new name and a truncated or
+    # replaced file starts over.
+    nl = mm.find(b"\n")
+    if nl < 0:
+        return None
+    return hashlib.sha1(mm[: nl + 1]).hexdigest()
+
+
+def parse_log_line(line: str):
+    # "2026-03-05 10:01:02,345 - INFO - SUCCESS | Ref=... | Debit=... | ..."
+    parts = line.split(" - ", 2)
+    if len(parts) != 3:
+        return None
+    ts, _, message = parts
+    fields = message.rstrip("\r\n").split(" | ")
+    kind = fields[0].strip()
+    if kind not in LOG_INDEXED_KINDS:
+        return None
+    values = {}
+    for field in fields[1:]:
+        key, sep, value = field.partition("=")
+        if sep:
+            values[key.strip()] = value.strip()
+    if "Ref" not in values:
+        return None
+    try:
+        rows = int(values.get("Rows", ""))
+    except ValueError:
+        rows = None
+    return (
+        ts,
+        kind,
+        values["Ref"],
+        values.get("Debit"),
+        values.get("Payee"),
+        rows,
+        values.get("File"),
+    )
+
+
+def index_log_file(db, path):
+    # Returns the number of new events. Only complete lines are read; a
+    # half-written last line is picked up by the next run.
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            signature = log_signature(mm)
+            if signature is None:
+                return 0
+            known = db.execute(
+                "SELECT id, offset FROM sources WHERE signature = ?", (signature,)
+            ).fetchone()
+            if known is None:
+                source = db.execute(
+                    "INSERT INTO sources (signature, offset) VALUES (?, 0)",
+                    (signature,),
+                ).lastrowid
+                offset = 0
+            else:
+                source, offset = known
+            if offset > size:
+                db.execute("DELETE FROM events WHERE source = ?", (source,))
+                offset = 0
+            end = mm.rfind(b"\n", offset) + 1
+            if end <= offset:
+                db.commit()
+                return 0
+
+            added = 0
+            batch_rows = []
+            pos = offset
+            while pos < end:
+                nl = mm.find(b"\n", pos, end)
+                line = mm[pos:nl]
+                if b"| Ref=" in line:
+                    event = parse_log_line(line.decode("utf-8", "replace"))
+                    if event is not None:
+                        batch_rows.append(event + (source, pos))
+                pos = nl + 1
+                if len(batch_rows) >= LOG_INDEX_BATCH:
+                    db.executemany(
+                        "INSERT INTO events VALUES (?,?,?,?,?,?,?,?,?)", batch_rows
+                    )
+                    added += len(batch_rows)
+                    batch_rows.clear()
+            db.executemany("INSERT INTO events VALUES (?,?,?,?,?,?,?,?,?)", batch_rows)
+            added += len(batch_rows)
+
+    # Events and the checkpoint commit together, so a crash never skips lines
+    db.execute(
+        "UPDATE sources SET path = ?, offset = ?, updated = ? WHERE id = ?",
+        (path, end, datetime.now().isoformat(timespec="seconds"), source),
+    )
+    db.commit()
+    return added
+
+
+def open_log_index(path):
+    db = sqlite3.connect(path)
+    db.executescript(LOG_INDEX_SCHEMA)
+    return db
+
+
+def update_log_index(db, pattern):
+    # Oldest rotated files first so events land roughly in time order
+    paths = sorted(glob.glob(pattern), key=os.path.getmtime)
+    return sum(index_log_file(db, p) for p in paths if os.path.isfile(p))
+
+
+def run_log_index(args):
+    started = time.perf_counter()
+    with closing(open_log_index(args.index)) as db:
+        added = update_log_index(db, args.logs)
+        total = db.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+    elapsed = time.perf_counter() - started
+    print(f"{added} new events, {total} indexed ({elapsed:.2f}s)")
+    return 0
+
+
+def run_log_query(args):
+    started = time.perf_counter()
+    where, params = [], []
+    if args.ref:
+        where.append("ref = ?")
+        params.append(args.ref)
+    if args.account:
+        # Logs record bank labels; accept either a label or an account number
+        labels = [
+            label
+            for label, acc_no in bank_account_map.items()
+            if args.account in (label, acc_no)
+        ] or [args.account]
+        marks = ",".join("?" * len(labels))
+        where.append(f"(debit IN ({marks}) OR payee IN ({marks}))")
+        params.extend(labels + labels)
+    # ts starts with yyyy-mm-dd, so day ranges are prefix ranges on the index
+    first = args.date or args.since
+    last = args.date or args.until
+    for value in (first, last):
+        if value and normalize_recon_date(value) is None:
+            raise SystemExit(f"Not a date: {value!r} (use dd/mm/yyyy or yyyy-mm-dd)")
+    if first:
+        where.append("ts >= ?")
+        params.append(normalize_recon_date(first))
+    if last:
+        where.append("ts < ?")
+        params.append(normalize_recon_date(last) + "~")
+    if args.kind:
+        where.append("kind = ?")
+        params.append(args.kind.upper())
+
+    sql = "SELECT ts, kind, ref, debit, payee, rows, file FROM events"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY ts LIMIT ?"
+    params.append(args.limit)
+
+    with closing(open_log_index(args.index)) as db:
+        if not args.no_update:
+            update_log_index(db, args.logs)
+        found = db.execute(sql, params).fetchall()
+    elapsed = time.perf_counter() - started
+
+    for ts, kind, ref, debit, payee, rows, file in found:
+        line = f"{ts} | {kind:<7} | Ref={ref} | Rows={rows}"
+        if debit or payee:
+            line += f" | Debit={debit} | Payee={payee}"
+        if file:
+            line += f" | File={file}"
+        print(line)
+    print(f"{len(found)} events ({elapsed * 1000:.0f} ms)")
+    return 0
+
+
+# ---------------- METRICS ---------------- #
+# Upper bounds (seconds) of the latency histogram buckets
+METRIC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+METRICS_DUMP_SECONDS = 60
+
+
+class Metrics:
+    # In-memory timers/counters. When disabled, timed() hands back the
+    # original function, so instrumented code pays nothing at all.
+    def __init__(self, enabled=False, path=None):
+        self.enabled = enabled
+        self.path = path
+        self.started = time.time()
+        self._timers = {}  # name -> [bucket counts..., +Inf count, sum, max]
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def timed(self, name):
+        def decorate(fn):
+            if not self.enabled:
+                return fn
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+
+            return wrapper
+
+        return decorate
+
+    def observe(self, name, seconds):
+        slot = bisect.bisect_left(METRIC_BUCKETS, seconds)
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                timer = self._timers[name] = [0] * (len(METRIC_BUCKETS) + 1) + [
+                    0.0,
+                    0.0,
+                ]
+            timer[slot] += 1
+            timer[-2] += seconds
+            if seconds > timer[-1]:
+                timer[-1] = seconds
+
+    def inc(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            timers = {name: list(t) for name, t in self._timers.items()}
+            counters = dict(self._counters)
+        out = {}
+        for name, t in sorted(timers.items()):
+            counts = t[: len(METRIC_BUCKETS) + 1]
+            out[name] = {
+                "count": sum(counts),
+                "sum": t[-2],
+                "max": t[-1],
+                "buckets": counts,
+            }
+        return {
+            "started": self.started,
+            "generated": time.time(),
+            "timers": out,
+            "counters": dict(sorted(counters.items())),
+        }
+
+    def render_prometheus(self, snap) -> str:
+        lines = []
+        for name, t in snap["timers"].items():
+            metric = f"fund_transfer_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            running = 0
+            for bound, count in zip(METRIC_BUCKETS + ("+Inf",), t["buckets"]):
+                running += count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {running}')
+            lines.append(f"{metric}_sum {t['sum']:.6f}")
+            lines.append(f"{metric}_count {t['count']}")
+        for name, value in snap["counters"].items():
+            metric = f"fund_transfer_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def render_table(self, snap) -> str:
+        lines = [f"{'timer':<22}{'count':>8}{'avg ms':>10}{'max ms':>10}"]
+        for name, t in snap["timers"].items():
+            avg = t["sum"] / t["count"] * 1000 if t["count"] else 0
+            lines.append(
+                f"{name:<22}{t['count']:>8}{avg:>10.1f}{t['max'] * 1000:>10.1f}"
+            )
+        lines.append("")
+        for name, value in snap["counters"].items():
+            lines.append(f"{name:<22}{value:>8}")
+        return "\n".join(lines)
+
+    def dump(self):
+        if not (self.enabled and self.path):
+            return
+        snap = self.snapshot()
+        if self.path.lower().endswith(".json"):
+            text = json.dumps(snap, indent=2)
+        else:
+            text = self.render_prometheus(snap)
+        # Write then rename so the scraper never reads a half-written file
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+
+
+# ---------------- PROFILING ---------------- #
+PROFILE_STALL_MS = 250
+PROFILE_HEARTBEAT_MS = 50
+
+
+def describe_tk_callback(wrapper):
+    func = wrapper.func
+    qualname = getattr(func, "__qualname__", type(func).__name__)
+    if qualname.endswith("after.<locals>.callit"):
+        # Misc.after() hides the real callback in the closure of callit
+        cells = dict(zip(func.__code__.co_freevars, func.__closure__ or ()))
+        inner = cells["func"].cell_contents if "func" in cells else func
+        name = getattr(inner, "__qualname__", type(inner).__name__)
+        return "after", f"{getattr(inner, '__module__', '')}.{name}"
+    kind = "event" if wrapper.subst else "command"
+    owner = getattr(func, "__self__", None)
+    if owner is not None and hasattr(owner, "_w"):
+        return kind, f"{qualname} [{owner._w}]"
+    return kind, f"{getattr(func, '__module__', '')}.{qualname}"
+
+
+class SessionProfiler:
+    # cProfile over the whole session, plus per-callback timings of Tk
+    # handlers and a watchdog thread that records event-loop stalls. Stalls
+    # and callback timings hit the disk as soon as a stall is seen, so a hung
+    # session that gets killed still leaves them behind.
+    def __init__(self, out_dir, stall_ms=PROFILE_STALL_MS):
+        self.bundle = os.path.join(
+            out_dir, datetime.now().strftime("profile-%Y%m%d-%H%M%S")
+        )
+        self.stall_seconds = stall_ms / 1000
+        self.profile = cProfile.Profile()
+        self.callbacks = {}  # (kind, name) -> [calls, total, max]
+        self.stalls = []
+        self.current = None
+        self._beat = time.perf_counter()
+        self._stall_open = False
+        self._stop = threading.Event()
+        self._main_thread = threading.main_thread().ident
+        self._original_call = None
+        self._stalls_lock = threading.Lock()
+        # The profiler's own after() loop is not part of the app's timings
+        self._own_callback = (
+            "after",
+            f"{type(self).__module__}.{type(self).__qualname__}._heartbeat",
+        )
+
+    def start(self, root):
+        os.makedirs(self.bundle, exist_ok=True)
+        self._root = root
+        self._original_call = tkinter.CallWrapper.__call__
+        profiler = self
+
+        def timed_call(wrapper, *args):
+            key = describe_tk_callback(wrapper)
+            if key == profiler._own_callback:
+                return profiler._original_call(wrapper, *args)
+            outer = profiler.current
+            profiler.current = key
+            start = time.perf_counter()
+            try:
+                return profiler._original_call(wrapper, *args)
+            finally:
+                elapsed = time.perf_counter() - start
+                profiler.current = outer
+                stats = profiler.callbacks.get(key)
+                if stats is None:
+                    stats = profiler.callbacks[key] = [0, 0.0, 0.0]
+                stats[0] += 1
+                stats[1] += elapsed
+                if elapsed > stats[2]:
+                    stats[2] = elapsed
+
+        tkinter.CallWrapper.__call__ = timed_call
+        root.after(PROFILE_HEARTBEAT_MS, self._heartbeat)
+        threading.Thread(target=self._watchdog, daemon=True).start()
+        self.profile.enable()
+
+    def _heartbeat(self):
+        now = time.perf_counter()
+        if self._stall_open:
+            with self._stalls_lock:
+                self.stalls[-1]["duration_ms"] = round((now - self._beat) * 1000, 1)
+                self._stall_open = False
+            self.write_live_files()
+        self._beat = now
+        if not self._stop.is_set():
+            self._root.after(PROFILE_HEARTBEAT_MS, self._heartbeat)
+
+    def _watchdog(self):
+        while not self._stop.wait(PROFILE_HEARTBEAT_MS / 1000):
+            lag = time.perf_counter() - self._beat
+            if self._stall_open or lag < self.stall_seconds:
+                continue
+            frame = sys._current_frames().get(self._main_thread)
+            kind, name = self.current or ("", "")
+            with self._stalls_lock:
+                self.stalls.append(
+                    {
+                        "at": datetime.now().isoformat(timespec="milliseconds"),
+                        "duration_ms": round(lag * 1000, 1),  # updated when it ends
+                        "callback": name,
+                        "kind": kind,
+                        "stack": traceback.format_stack(frame) if frame else [],
+                    }
+                )
+                self._stall_open = True
+            # The main thread may never come back, so write from here
+            self.write_live_files()
+
+    def _write_json(self, name, data):
+        path = os.path.join(self.bundle, name)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, path)
+
+    def write_live_files(self):
+        # Called from both threads; dict()/list() copies are taken under the GIL
+        with self._stalls_lock:
+            stalls = {
+                "threshold_ms": self.stall_seconds * 1000,
+                "stalls": list(self.stalls),
+            }
+            callbacks = [
+                {
+                    "kind": kind,
+                    "callback": name,
+                    "calls": calls,
+                    "total_ms": round(total * 1000, 3),
+                    "max_ms": round(worst * 1000, 3),
+                }
+                for (kind, name), (calls, total, worst) in sorted(
+                    dict(self.callbacks).items(), key=lambda item: -item[1][1]
+                )
+            ]
+            try:
+                self._write_json("stalls.json", stalls)
+                self._write_json("callbacks.json", callbacks)
+            except OSError as e:
+                logging.error(f"Profile write failed: {str(e)}")
+
+    def stop(self):
+        self.profile.disable()
+        self._stop.set()
+        if self._original_call is not None:
+            tkinter.CallWrapper.__call__ = self._original_call
+
+    def write_bundle(self) -> str:
+        os.makedirs(self.bundle, exist_ok=True)
+
+        # session.prof loads in pstats, snakeviz, gprof2dot, ...
+        self.profile.dump_stats(os.path.join(self.bundle, "session.prof"))
+        summary = io.StringIO()
+        pstats.Stats(self.profile, stream=summary).sort_stats("cumulative").print_stats(
+            40
+        )
+        with open(os.path.join(self.bundle, "summary.txt"), "w", encoding="utf-8") as f:
+            f.write(summary.getvalue())
+
+        self.write_live_files()
+        return self.bundle
+
+
+def run_check_dates(args):
+    try:
+        calendar = PaymentCalendar(*load_holidays(args.holidays))
+    except (ValueError, OSError) as e:
+        raise SystemExit(f"Cannot read holidays: {e}")
+    started = time.perf_counter()
+    with open(args.file, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        header = [h.strip() for h in next(reader, [])]
+        if args.column not in header:
+            raise SystemExit(f"{args.file}: no column named {args.column!r}")
+        i_date = header.index(args.column)
+        values = [row[i_date] if len(row) > i_date else "" for row in reader]
+    problems = list(validate_payment_dates(calendar, values))
+    elapsed = time.perf_counter() - started
+
+    for index, value, problem in problems[:50]:
+        # +2: header line and 1-based line numbers
+        print(f"line {index + 2}: {value!r}: {problem}")
+    if len(problems) > 50:
+        print(f"... and {len(problems) - 50} more")
+    print(f"{len(values)} rows, {len(problems)} bad dates ({elapsed * 1000:.0f} ms)")
+    return 1 if problems else 0
+
+
+# ---------------- COMMAND LINE ---------------- #
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Fund Transfer File Generator")
+    commands = parser.add_subparsers(dest="command")
+
+    rec = commands.add_parser(
+        "reconcile", help="Match generated CSVs against a bank statement export"
+    )
+    rec.add_argument(
+        "generated", nargs="+", help="Generated CSV files or folders of them"
+    )
+    rec.add_argument(
+        "--statement", nargs="+", required=True, help="Bank statement CSV file(s)"
+    )
+    rec.add_argument(
+        "--statement-columns",
+        help="Statement header names for reference,account,amount,date "
+        "(defaults to our own column names)",
+    )
+    rec.add_argument("--report", help="Write every unmatched item to this CSV")
+    rec.set_defaults(handler=run_reconcile)
+
+    chk = commands.add_parser(
+        "check-dates", help="Check a CSV's payment dates against the calendar"
+    )
+    chk.add_argument("file", help="CSV file to check")
+    chk.add_argument("--column", default=columns[5], help="Payment date column header")
+    chk.set_defaults(handler=run_check_dates)
+
+    idx = commands.add_parser(
+        "log-index", help="Index new lines of transfers.log for log-query"
+    )
+    qry = commands.add_parser("log-query", help="Look up transfers in the log index")
+    for sub in (idx, qry):
+        sub.add_argument(
+            "--logs", default=LOG_FILES, help="Log files to index (glob pattern)"
+        )
+        sub.add_argument("--index", default=LOG_INDEX_FILE, help="Index database")
+    idx.set_defaults(handler=run_log_index)
+
+    qry.add_argument("--ref", help="Customer reference")
+    qry.add_argument("--account", help="Debit or payee bank label or account no.")
+    qry.add_argument("--date", help="Day logged (dd/mm/yyyy or yyyy-mm-dd)")
+    qry.add_argument("--since", help="First day logged")
+    qry.add_argument("--until", help="Last day logged")
+    qry.add_argument("--kind", help="PREVIEW, SUCCESS or ERROR")
+    qry.add_argument("--limit", type=int, default=200)
+    qry.add_argument(
+        "--no-update", action="store_true", help="Query without indexing new lines"
+    )
+    qry.set_defaults(handler=run_log_query)
+
+    parser.add_argument(
+        "--holidays",
+        default=HOLIDAYS_FILE,
+        help="Holiday list (dd/mm/yyyy or dd/mm per line)",
+    )
+
+    parser.add_argument(
+        "--preview-cache-mb",
+        type=float,
+        default=PREVIEW_CACHE_MAX_MB,
+        help="Memory bound for cached previews (0 disables the cache)",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="PATH",
+        help="Collect timings and dump them to PATH (.json, otherwise "
+        "Prometheus text format)",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=METRICS_DUMP_SECONDS,
+        help="Seconds between metrics dumps",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="profiles",
+        metavar="DIR",
+        help="Profile the session and write a bundle to DIR on exit",
+    )
+    parser.add_argument(
+        "--stall-ms",
+        type=float,
+        default=PROFILE_STALL_MS,
+        help="Record event-loop stalls longer than this (with --profile)",
+    )
+    return parser
+
+
+launch_args = build_arg_parser().parse_args(
+    sys.argv[1:] if __name__ == "__main__" else []
+)
+if launch_args.command:
+    # CLI commands run headless and never build the window
+    sys.exit(launch_args.handler(launch_args))
+
+metrics = Metrics(enabled=bool(launch_args.metrics), path=launch_args.metrics)
+# A bad holidays file must not stop a pythonw launch (no console to see it);
+# fall back to weekends and FIXED_HOLIDAYS and tell the operator once the
+# window is up.
+holidays_error = None
+try:
+    payment_calendar = PaymentCalendar(*load_holidays(launch_args.holidays))
+except (ValueError, OSError) as e:
+    holidays_error = str(e)
+    logging.error(f"Holidays file ignored: {holidays_error}")
+    payment_calendar = PaymentCalendar()
+
+
 # ---------------- APP WINDOW ---------------- #
 app = ctk.CTk()
 app.title("Fund Transfer File Generator")
@@ -303,7 +1645,9 @@ main_frame.grid_columnconfigure(2, weight=1)
 main_frame.grid_rowconfigure(0, weight=1)
 
 # Defaults for reset
-DEFAULT_DATE = datetime.now()
+DEFAULT_DATE = datetime.combine(
+    payment_calendar.next_business_day(date.today()), datetime.min.time()
+)
 DEBIT_VALUES = ["SCB (02-01)", "SCB (01-02)", "SCB (01-01)"]
 PAYEE_VALUES = ["SCB (01-01)", "SCB (01-02)", "SCB (02-01)"]
 REASON_VALUES = ["OTH/FT", "OTH/PULLING", "OTH/RETURN"]
@@ -329,7 +1673,9 @@ ctk.CTkLabel(
     left_card, text="Enter Payment Date", font=FONT_LABEL, text_color=TEXT_MUTED
 ).pack(anchor="w", padx=20, pady=(10, 6))
 
-date_picker = ModernDatePicker(left_card, initial_date=DEFAULT_DATE)
+date_picker = ModernDatePicker(
+    left_card, initial_date=DEFAULT_DATE, payment_calendar=payment_calendar
+)
 date_picker.pack(fill="x", padx=20)
 
 ctk.CTkLabel(
@@ -483,17 +1829,6 @@ tree_host.grid_rowconfigure(0, weight=1)
 tree_host.grid_columnconfigure(0, weight=1)
 tree_host.grid_columnconfigure(1, weight=0)
 
-columns = [
-    "Customer Reference (GL)",
-    "Payee Name",
-    "Payee Bank Acc No.",
-    "Amount",
-    "Reason",
-    "Payment Date (dd-mm-yy)",
-    "Debit Acc No.",
-    "Payee Email Address",
-]
-
 # ttk styling
 style = ttk.Style()
 try:
@@ -550,6 +1885,7 @@ COLUMN_WEIGHTS = [1.25, 1.35, 1.15, 0.85, 1.35, 1.25, 1.10, 1.60]
 COLUMN_MIN_WIDTHS = [240, 260, 220, 160, 260, 260, 220, 320]
 
 
+@metrics.timed("autosize_columns")
 def autosize_columns(event=None):
     tree_host.update_idletasks()
 
@@ -588,6 +1924,12 @@ tree.tag_configure("even", background="#E5EAEF")
 
 # ---------------- FUNCTIONS ---------------- #
 def update_line_items():
+    if preview_mode == "batch":
+        line_items_var.set(
+            f"Batch: {len(batch)} transfers | Total line items: {batch.row_count}"
+            f" | Total: {batch.total:,}"
+        )
+        return
     line_items_var.set(f"Total line items: {len(entries_data)}")
 
 
@@ -611,7 +1953,7 @@ def set_status(message):
     status_var.set(f"Status: {message}")
 
 
-def build_rows_from_form():
+def read_form_key():
     ref = customer_ref.get().strip()
     amt_text = amount_entry.get().strip()
 
@@ -628,8 +1970,8 @@ def build_rows_from_form():
         return None
 
     try:
-        debit_acc_no = get_bank_acc(debit_dropdown.get())
-        payee_acc_no = get_bank_acc(payee_dropdown.get())
+        get_bank_acc(debit_dropdown.get())
+        get_bank_acc(payee_dropdown.get())
     except ValueError as e:
         messagebox.showerror("Error", str(e))
         return None
@@ -643,6 +1985,40 @@ def build_rows_from_form():
         messagebox.showerror("Error!", "Please select a payment date.")
         return None
 
+    pay_day = parse_payment_date(pay_date)
+    if pay_day is None:
+        messagebox.showerror("Error!", "Payment date must be dd/mm/yyyy.")
+        return None
+    problem = payment_calendar.check_date(pay_date)
+    if problem:
+        nxt = payment_calendar.next_business_day(pay_day)
+        nxt_text = nxt.strftime(PAYMENT_DATE_FORMAT)
+        if not messagebox.askyesno(
+            "Not a business day",
+            f"{pay_date} is a {problem}. Use the next business day, {nxt_text}?",
+        ):
+            return None
+        date_picker.set_text(nxt_text)
+        pay_date = nxt_text
+
+    # Normalised form tuple; also the preview cache key
+    return (
+        ref,
+        total_amt,
+        debit_dropdown.get(),
+        payee_dropdown.get(),
+        reason_dropdown.get(),
+        email_dropdown.get(),
+        pay_date,
+    )
+
+
+@metrics.timed("build_rows")
+def build_rows(key):
+    ref, total_amt, debit_label, payee_label, reason, email, pay_date = key
+    debit_acc_no = get_bank_acc(debit_label)
+    payee_acc_no = get_bank_acc(payee_label)
+
     chunks = split_amount(total_amt, MAX_PER_ROW)
 
     rows = []
@@ -653,16 +2029,21 @@ def build_rows_from_form():
                 "Robi Axiata Limited",
                 payee_acc_no,
                 str(excel_number(chunk)),  # CSV-safe (no commas)
-                reason_dropdown.get() + ref,
+                reason + ref,
                 pay_date,
                 debit_acc_no,
-                email_dropdown.get(),
+                email,
             )
         )
     return rows
 
 
+@metrics.timed("load_preview")
 def load_preview(rows):
+    global preview_mode
+
+    preview_mode = "single"
+    batch_items.clear()
     tree.delete(*tree.get_children())
     for idx, row in enumerate(rows):
         tag = "even" if idx % 2 else "odd"
@@ -672,15 +2053,6 @@ def load_preview(rows):
     set_status("Preview Generated")
 
 
-# def preview_file():
-#     global entries_data
-#     rows = build_rows_from_form()
-#     if rows is None:
-#         return
-#     entries_data = rows
-#     load_preview(rows)
-
-
 def preview_file():
     global entries_data
 
@@ -688,11 +2060,12 @@ def preview_file():
     app.update_idletasks()
 
     try:
-        rows = build_rows_from_form()
-        if rows is None:
+        key = read_form_key()
+        if key is None:
             return
 
-        entries_data = rows
+        rows = rows_for_key(key)
+        entries_data = list(rows)
         load_preview(rows)
 
         logging.info(
@@ -707,7 +2080,149 @@ def preview_file():
         preview_btn.configure(state="normal")
 
 
+def rows_for_key(key):
+    rows = preview_cache.get(key)
+    if rows is None:
+        metrics.inc("preview_cache_misses")
+        rows = preview_cache.put(key, build_rows(key))
+    else:
+        metrics.inc("preview_cache_hits")
+    # Hits reorder the LRU too, so the menu follows every lookup
+    refresh_recent_previews()
+    return rows
+
+
+@metrics.timed("insert_batch_rows")
+def insert_batch_rows(transfer_id, rows):
+    # Rows of one transfer share a stripe so transfers read as blocks; item
+    # ids are "<transfer id>:<row>" so a selection maps back to its transfer
+    tag = "even" if transfer_id % 2 else "odd"
+    batch_items[transfer_id] = [
+        tree.insert("", "end", iid=f"{transfer_id}:{n}", values=row, tags=(tag,))
+        for n, row in enumerate(rows)
+    ]
+
+
+@metrics.timed("show_batch")
+def show_batch():
+    global preview_mode
+
+    preview_mode = "batch"
+    batch_items.clear()
+    tree.delete(*tree.get_children())
+    for transfer_id, _, rows in batch.transfers():
+        insert_batch_rows(transfer_id, rows)
+    autosize_columns()
+    update_line_items()
+
+
+def add_to_batch():
+    try:
+        key = read_form_key()
+        if key is None:
+            return
+
+        # Adding the same transfer twice would pay it twice
+        if batch.has_key(key) and not messagebox.askyesno(
+            "Already in Batch",
+            f"{preview_label(key)}\n\nThis transfer is already in the batch. "
+            "Add it again?",
+        ):
+            set_status("Duplicate transfer not added")
+            return
+
+        rows = rows_for_key(key)
+        transfer_id = batch.add(key, rows)
+        amount_entry.delete(0, "end")
+        if preview_mode == "batch":
+            insert_batch_rows(transfer_id, rows)
+            update_line_items()
+        else:
+            show_batch()
+
+        logging.info(f"BATCH ADD | Ref={key[0]} | Rows={len(rows)}")
+        set_status(f"Added {key[0]} to batch")
+
+    except Exception as e:
+        logging.error(f"Add to batch failed: {str(e)}")
+        messagebox.showerror("Error", "Unexpected error while adding to batch.")
+
+
+def remove_from_batch():
+    if preview_mode != "batch":
+        show_batch()
+        set_status("Select rows in the batch to remove")
+        return
+
+    selected = tree.selection()
+    if not selected:
+        messagebox.showerror("Error", "Select a row of the transfer to remove.")
+        return
+
+    removed = {int(iid.split(":", 1)[0]) for iid in selected}
+    for transfer_id in removed:
+        tree.delete(*batch_items.pop(transfer_id))
+        key, _ = batch.remove(transfer_id)
+        logging.info(f"BATCH REMOVE | Ref={key[0]}")
+
+    update_line_items()
+    set_status(f"Removed {len(removed)} transfer(s) from batch")
+
+
+def refresh_recent_previews():
+    recent_previews.clear()
+    for key in preview_cache.recent():
+        label_text = preview_label(key)
+        n = 2
+        while label_text in recent_previews:
+            label_text = f"{preview_label(key)} ({n})"
+            n += 1
+        recent_previews[label_text] = key
+    labels = list(recent_previews) or [NO_RECENT_PREVIEWS]
+    recent_dropdown.configure(
+        values=labels, state="normal" if recent_previews else "disabled"
+    )
+    recent_dropdown.set(
+        RECENT_PREVIEWS_PROMPT if recent_previews else NO_RECENT_PREVIEWS
+    )
+
+
+def restore_preview(label_text):
+    global entries_data
+
+    key = recent_previews.get(label_text)
+    rows = preview_cache.get(key) if key is not None else None
+    if rows is None:
+        # Evicted, or invalidated by an account/split-limit change
+        refresh_recent_previews()
+        set_status("Preview no longer cached")
+        return
+
+    ref, total_amt, debit_label, payee_label, reason, email, pay_date = key
+    customer_ref.delete(0, "end")
+    customer_ref.insert(0, ref)
+    amount_entry.delete(0, "end")
+    amount_entry.insert(0, f"{total_amt:,}")
+    debit_dropdown.set(debit_label)
+    payee_dropdown.set(payee_label)
+    reason_dropdown.set(reason)
+    email_dropdown.set(email)
+    date_picker.set_text(pay_date)
+
+    entries_data = list(rows)
+    load_preview(rows)
+    set_status("Preview Restored")
+    refresh_recent_previews()
+
+
 def clear_preview():
+    if preview_mode == "batch":
+        if batch and not messagebox.askyesno(
+            "Clear Batch", f"Discard all {len(batch)} transfers in the batch?"
+        ):
+            return
+        batch.clear()
+        batch_items.clear()
     entries_data.clear()
     tree.delete(*tree.get_children())
     update_line_items()
@@ -724,11 +2239,99 @@ def clear_selection():
     email_dropdown.set(DEFAULT_EMAIL)
 
     date_picker.set_date(DEFAULT_DATE)
-    clear_preview()
+    if preview_mode == "single":
+        clear_preview()
     set_status("Form Reset")
 
 
+@metrics.timed("csv_write")
+def write_transfer_csv(filepath, rows):
+    with open(filepath, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        if metrics.enabled:
+            rows = list(rows)
+            metrics.inc("csv_rows_written", len(rows))
+        writer.writerows(rows)
+
+
+@metrics.timed("archive_write")
+def write_transfer_archive(filepath, entries):
+    # entries: (filename, rows, ref) per CSV inside the archive
+    with ArchiveWriter(filepath) as archive:
+        for filename, rows, ref in entries:
+            archive.add(filename, rows, ref=ref)
+            metrics.inc("csv_rows_written", len(rows))
+
+
+@metrics.timed("download_file")
+def save_export(filepath, entries, rows):
+    # The work behind Download CSV, timed without the save and info dialogs.
+    # entries feed an archive, rows a single CSV.
+    if is_archive_path(filepath):
+        write_transfer_archive(filepath, entries)
+    else:
+        write_transfer_csv(filepath, rows)
+
+
+def export_batch():
+    if not batch:
+        messagebox.showerror("Error", "Nothing to export. Add transfers to the batch.")
+        return
+
+    filename = build_batch_filename(len(batch), batch.pay_dates())
+    filepath = filedialog.asksaveasfilename(
+        defaultextension=".csv",
+        initialfile=filename,
+        filetypes=EXPORT_FILETYPES,
+    )
+    if not filepath:
+        logging.info("User cancelled save dialog.")
+        return
+
+    try:
+        # In an archive each transfer is its own CSV under its usual name
+        save_export(
+            filepath,
+            (
+                (build_csv_filename(key[0], key[2], key[3], key[6]), rows, key[0])
+                for _, key, rows in batch.transfers()
+            ),
+            batch.iter_rows(),
+        )
+
+        # One SUCCESS line per transfer keeps the audit trail per reference
+        for _, key, rows in batch.transfers():
+            logging.info(
+                f"SUCCESS | Ref={key[0]} | Debit={key[2]} | "
+                f"Payee={key[3]} | Rows={len(rows)} | File={filepath}"
+            )
+        pair_summary = "\n".join(
+            f"{debit} > {payee}: {total:,}"
+            for (debit, payee), total in batch.pair_totals.items()
+        )
+        logging.info(
+            f"BATCH | Transfers={len(batch)} | Rows={batch.row_count} | "
+            f"Total={batch.total} | File={filepath}"
+        )
+
+        messagebox.showinfo(
+            "Success",
+            f"Batch CSV saved ({len(batch)} transfers, {batch.row_count} rows):\n"
+            f"{filepath}\n\n{pair_summary}",
+        )
+        set_status("Batch CSV Saved Successfully")
+
+    except Exception as e:
+        logging.error(f"ERROR | Batch | Transfers={len(batch)} | Reason={str(e)}")
+        messagebox.showerror("Error", f"Failed to save CSV:\n{e}")
+
+
 def download_file():
+    if preview_mode == "batch":
+        export_batch()
+        return
+
     if not entries_data:
         messagebox.showerror("Error", "Nothing to export. Click Preview File first.")
         return
@@ -743,7 +2346,7 @@ def download_file():
     filepath = filedialog.asksaveasfilename(
         defaultextension=".csv",
         initialfile=filename,
-        filetypes=[("CSV files", "*.csv")],
+        filetypes=EXPORT_FILETYPES,
     )
 
     # if not filepath:
@@ -751,10 +2354,7 @@ def download_file():
     # return
 
     try:
-        with open(filepath, "w", newline="", encoding="utf-8-sig") as f:
-            writer = csv.writer(f)
-            writer.writerow(columns)
-            writer.writerows(entries_data)
+        save_export(filepath, [(filename, entries_data, ref)], entries_data)
         # logging.info(f"CSV created: {filepath}")
 
         logging.info(
@@ -829,12 +2429,139 @@ clear_sel_btn = ctk.CTkButton(
 )
 clear_sel_btn.pack(fill="x", padx=25, pady=(0, 10))
 
+# Batch (several transfers exported as one file)
+batch = TransferBatch()
+batch_items = {}  # transfer id -> tree item ids
+
+ctk.CTkLabel(right_card, text="Batch", font=FONT_H1, text_color=TEXT_DARK).pack(
+    anchor="w", padx=20, pady=(8, 6)
+)
+
+add_batch_btn = ctk.CTkButton(
+    right_card,
+    text="Add to Batch",
+    height=40,
+    fg_color=ACCENT,
+    hover_color="#173CA2",
+    text_color="#FFFFFF",
+    font=FONT_BODY,
+    command=add_to_batch,
+)
+add_batch_btn.pack(fill="x", padx=25, pady=(0, 10))
+
+view_batch_btn = ctk.CTkButton(
+    right_card,
+    text="View Batch",
+    height=40,
+    fg_color="#E2E8F0",
+    hover_color="#CBD5E1",
+    text_color=TEXT_DARK,
+    font=FONT_BODY,
+    command=show_batch,
+)
+view_batch_btn.pack(fill="x", padx=25, pady=(0, 10))
+
+remove_batch_btn = ctk.CTkButton(
+    right_card,
+    text="Remove Selected",
+    height=40,
+    fg_color="#E2E8F0",
+    hover_color="#CBD5E1",
+    text_color=TEXT_DARK,
+    font=FONT_BODY,
+    command=remove_from_batch,
+)
+remove_batch_btn.pack(fill="x", padx=25, pady=(0, 10))
+
+# Recent previews (served from the preview cache, no recomputation)
+RECENT_PREVIEWS_PROMPT = "Recent previews"
+NO_RECENT_PREVIEWS = "No recent previews"
+recent_previews = {}
+preview_cache = PreviewCache(max_mb=launch_args.preview_cache_mb)
+
+recent_dropdown = ctk.CTkOptionMenu(
+    right_card,
+    values=[NO_RECENT_PREVIEWS],
+    height=40,
+    fg_color="#E2E8F0",
+    button_color=ACCENT,
+    button_hover_color="#1D4ED8",
+    text_color=TEXT_DARK,
+    command=restore_preview,
+)
+recent_dropdown.pack(fill="x", padx=25, pady=(10, 10))
+style_optionmenu_dropdown(recent_dropdown)
+refresh_recent_previews()
+
 # init footer count
 update_line_items()
 
+if holidays_error:
+    app.after(
+        500,
+        lambda: messagebox.showwarning(
+            "Holidays",
+            f"Could not read the holidays file:\n{holidays_error}\n\n"
+            "Only weekends and fixed bank holidays are blocked.",
+        ),
+    )
+
+
+# ---------------- DIAGNOSTICS ---------------- #
+def open_diagnostics(event=None):
+    top = ctk.CTkToplevel(app)
+    top.title("Diagnostics")
+    top.geometry("520x420")
+    top.attributes("-topmost", True)
+
+    box = ctk.CTkTextbox(top, font=("Consolas", 13), fg_color=CARD_BG)
+    box.pack(fill="both", expand=True, padx=12, pady=12)
+
+    def refresh():
+        if not top.winfo_exists():
+            return
+        if metrics.enabled:
+            text = metrics.render_table(metrics.snapshot())
+        else:
+            text = "Metrics are off. Launch with --metrics PATH to collect them."
+        box.configure(state="normal")
+        box.delete("1.0", "end")
+        box.insert("1.0", text)
+        box.configure(state="disabled")
+        top.after(1000, refresh)
+
+    refresh()
+
+
+def dump_metrics_periodically():
+    try:
+        metrics.dump()
+    except OSError as e:
+        logging.error(f"Metrics dump failed: {str(e)}")
+    app.after(int(launch_args.metrics_interval * 1000), dump_metrics_periodically)
+
+
+# Hidden panel for support: Ctrl+Shift+D
+app.bind("<Control-Shift-D>", open_diagnostics)
+if metrics.enabled:
+    app.after(int(launch_args.metrics_interval * 1000), dump_metrics_periodically)
+
 
 def main():
-    app.mainloop()
+    profiler = None
+    if launch_args.profile:
+        profiler = SessionProfiler(launch_args.profile, launch_args.stall_ms)
+        profiler.start(app)
+        logging.info(f"PROFILE | Started | Bundle={profiler.bundle}")
+
+    try:
+        app.mainloop()
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            bundle = profiler.write_bundle()
+            logging.info(f"PROFILE | Bundle={bundle}")
+        metrics.dump()
 
 
 if __name__ == "__main__":
@@ -1,3 +1,3 @@
 @echo off
-pythonw FundTransfer.py
+pythonw FundTransfer.py %*
 exit
\ No newline at end of file
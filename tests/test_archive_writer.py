@@ -0,0 +1,59 @@
+import importlib.util
+import os
+import threading
+import zipfile
+from pathlib import Path
+
+import pytest
+
+SCRIPT = Path(__file__).resolve().parent.parent / "bank-fund-transfer-file-generator.py"
+
+
+@pytest.fixture(scope="module")
+def app_module():
+    # The script builds its window at import, so it needs the GUI libraries
+    # and a display; skip where either is missing.
+    pytest.importorskip("customtkinter")
+    pytest.importorskip("tkcalendar")
+    spec = importlib.util.spec_from_file_location("fund_transfer_app", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    cwd = os.getcwd()
+    os.chdir(SCRIPT.parent)  # icon and log paths are relative
+    try:
+        spec.loader.exec_module(module)
+    except Exception as e:
+        pytest.skip(f"app could not start here: {e}")
+    finally:
+        os.chdir(cwd)
+    yield module
+    module.app.destroy()
+
+
+def test_close_raises_when_manifest_write_fails(app_module, tmp_path, monkeypatch):
+    real_writestr = zipfile.ZipFile.writestr
+
+    def failing_writestr(self, name, data, *args, **kwargs):
+        if name == "manifest.json":
+            raise OSError("disk full")
+        return real_writestr(self, name, data, *args, **kwargs)
+
+    monkeypatch.setattr(zipfile.ZipFile, "writestr", failing_writestr)
+
+    path = tmp_path / "export.zip"
+    writer = app_module.ArchiveWriter(str(path))
+    writer.add("a.csv", [("A", "Robi")])
+    outcome = {}
+
+    def close():
+        try:
+            writer.close()
+        except OSError as e:
+            outcome["error"] = e
+
+    closer = threading.Thread(target=close, daemon=True)
+    closer.start()
+    closer.join(5)
+
+    assert not closer.is_alive(), "close() hung after the end marker was taken"
+    assert "disk full" in str(outcome["error"])
+    assert not path.exists()